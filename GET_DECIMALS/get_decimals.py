@@ -6,19 +6,73 @@
 """
 
 import pandas as pd
+from openpyxl import Workbook
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 import time
+import shutil
+import os
 import logging
-from typing import Dict, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Tuple
 import json
 
+# 优先使用orjson编解码JSON-RPC数据，未安装时退回标准库
+try:
+    import orjson
+    json_dumps, json_loads = orjson.dumps, orjson.loads
+except ImportError:
+    json_dumps, json_loads = json.dumps, json.loads
+
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+class TokenBucket:
+    """令牌桶限速器，用于控制对单个RPC端点的请求速率"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        Args:
+            rate: 每秒补充的令牌数
+            capacity: 令牌桶容量，默认等于rate
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """获取一个令牌，令牌不足时等待"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
 class DecimalsFetcher:
-    def __init__(self, excel_file: str = "test.xlsx"):
+    def __init__(self, excel_file: str = "test.xlsx", max_workers: int = 16, cache_file: str = ".decimals_cache.json"):
+        """
+        初始化精度获取器
+        
+        Args:
+            excel_file: Excel文件路径
+            max_workers: 最大线程数
+            cache_file: 精度缓存文件路径，在多次运行之间保留查询结果
+        """
         self.excel_file = excel_file
+        self.max_workers = max_workers
+        self.cache_file = cache_file
         
         # 配置各链的RPC节点 - 使用免费的公共节点
         self.rpc_endpoints = {
@@ -35,101 +89,331 @@ class DecimalsFetcher:
         # ERC20 decimals() 函数的方法签名
         self.decimals_signature = "0x313ce567"
         
+        # 每个批量请求中包含的eth_call数量，Optimism公共节点限制单批最多10个
+        self.default_batch_size = 25
+        self.batch_sizes = {
+            'optimism': 10
+        }
+        
+        # 每个RPC端点每秒允许发送的请求数，公共节点一般约10次/秒，Optimism为300次/分钟
+        self.rate_limits = {
+            'ethereum': 10,
+            'bsc': 10,
+            'polygon': 10,
+            'arbitrum': 10,
+            'avalanche': 10,
+            'fantom': 10,
+            'optimism': 5,
+            'base': 10
+        }
+        self.rate_limiters = {network: TokenBucket(self.rate_limits[network]) for network in self.rpc_endpoints}
+        
+        # 每个RPC端点同时进行中的请求数上限
+        self.max_concurrent_per_endpoint = 4
+        self.endpoint_semaphores = {network: threading.Semaphore(self.max_concurrent_per_endpoint) for network in self.rpc_endpoints}
+        
+        # 遇到429、5xx或连接错误时的最大重试次数，重试间隔按指数增长
+        self.max_retries = 3
+        # 429限流后单次等待的最长秒数，服务器要求更久时放弃重试
+        self.max_retry_wait = 60
+        
+        # 每个RPC端点使用一个持久session，保持keep-alive并复用TCP/TLS连接
+        self.sessions = {network: self.create_session() for network in self.rpc_endpoints}
+        
+        # 常见代币的已知精度，无需查询RPC
+        self.known_decimals = {
+            ('ethereum', '0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48'): 6,   # USDC
+            ('ethereum', '0xdac17f958d2ee523a2206206994597c13d831ec7'): 6,   # USDT
+            ('ethereum', '0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2'): 18,  # WETH
+            ('bsc', '0x8ac76a51cc950d9822d68b83fe1ad97b32cd580d'): 18,       # USDC
+            ('bsc', '0x55d398326f99059ff775485246999027b3197955'): 18,       # USDT
+            ('polygon', '0x3c499c542cef5e3811e1192ce70d8cc03d5c3359'): 6,    # USDC
+            ('polygon', '0x2791bca1f2de4661ed88a30c99a7a9449aa84174'): 6,    # USDC.e
+            ('polygon', '0xc2132d05d31c914a87c6611c10748aeb04b58e8f'): 6,    # USDT
+            ('polygon', '0x7ceb23fd6bc0add59e62ac25578270cff1b9f619'): 18,   # WETH
+            ('arbitrum', '0xaf88d065e77c8cc2239327c5edb3a432268e5831'): 6,   # USDC
+            ('arbitrum', '0xff970a61a04b1ca14834a43f5de4533ebddb5cc8'): 6,   # USDC.e
+            ('arbitrum', '0xfd086bc7cd5c481dcc9c85ebe478a1c0b69fcbb9'): 6,   # USDT
+            ('arbitrum', '0x82af49447d8a07e3bd95bd0d56f35241523fbab1'): 18,  # WETH
+            ('avalanche', '0xb97ef9ef8734c71904d8002f8b6bc66dd9c48a6e'): 6,  # USDC
+            ('avalanche', '0x9702230a8ea53601f5cd2dc00fdbc13d4df4a8c7'): 6,  # USDT
+            ('optimism', '0x0b2c639c533813f4aa9d7837caf62653d097ff85'): 6,   # USDC
+            ('optimism', '0x94b008aa00579c1307b0ef2c499ad98a8ce58e58'): 6,   # USDT
+            ('optimism', '0x4200000000000000000000000000000000000006'): 18,  # WETH
+            ('base', '0x833589fcd6edb6e08f4c7c32d4f71b54bda02913'): 6,       # USDC
+            ('base', '0x4200000000000000000000000000000000000006'): 18,      # WETH
+        }
+        
+        # 按 (网络, 合约地址) 缓存已查询到的精度，重复出现的代币无需再次查询
+        self._dec_cache: Dict[Tuple[str, str], int] = dict(self.known_decimals)
+        self.load_cache()
+        
+    def create_session(self) -> requests.Session:
+        """创建供线程池共享的session对象"""
+        session = requests.Session()
+        # 5xx和连接错误由urllib3自动退避重试
+        # 429不在此处重试：urllib3的重试会在占用并发名额时等待且绕过令牌桶，改由调用方在名额外退避
+        retry = Retry(
+            total=self.max_retries,
+            backoff_factor=0.3,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=['GET', 'POST']
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=16, pool_maxsize=32)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({
+            'Content-Type': 'application/json',
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        })
+        return session
+        
+    def cache_key(self, network: str, contract_address: str) -> Tuple[str, str]:
+        """生成精度缓存的键，统一网络名和合约地址的格式"""
+        contract_address = contract_address.lower()
+        if not contract_address.startswith('0x'):
+            contract_address = '0x' + contract_address
+        return network.lower(), contract_address
+    
+    def load_cache(self):
+        """从缓存文件加载之前查询到的精度"""
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            for key, decimals in cached.items():
+                network, contract_address = key.split(':', 1)
+                self._dec_cache[(network, contract_address)] = int(decimals)
+            logger.info(f"已从 {self.cache_file} 加载 {len(cached)} 条精度缓存")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"加载精度缓存失败: {e}")
+    
+    def save_cache(self):
+        """将精度缓存写入文件，供下次运行使用"""
+        try:
+            cached = {f"{network}:{contract_address}": decimals for (network, contract_address), decimals in self._dec_cache.items()}
+            with open(self.cache_file, 'w', encoding='utf-8') as f:
+                json.dump(cached, f, indent=2, sort_keys=True)
+            logger.info(f"精度缓存已保存到: {self.cache_file}")
+        except Exception as e:
+            logger.warning(f"保存精度缓存失败: {e}")
+    
     def get_rpc_endpoint(self, network: str) -> Optional[str]:
         """获取指定网络的RPC端点"""
         network_lower = network.lower()
         return self.rpc_endpoints.get(network_lower)
     
-    def call_contract_method(self, rpc_url: str, contract_address: str, method_signature: str) -> Optional[str]:
+    def retry_wait(self, retry_after: Optional[str], retry: int) -> Optional[float]:
         """
-        调用合约方法
+        计算429限流后的等待秒数，优先使用Retry-After响应头，否则按指数退避
+        
+        Args:
+            retry_after: Retry-After响应头的值，可以是秒数或HTTP日期
+            retry: 已重试的次数
+            
+        Returns:
+            等待秒数；服务器要求等待超过max_retry_wait时返回None，表示放弃重试
         """
+        if retry_after is None:
+            return min(2 ** retry, self.max_retry_wait)
+        
         try:
-            # 准备JSON-RPC请求
-            payload = {
-                "jsonrpc": "2.0",
-                "method": "eth_call",
-                "params": [
-                    {
-                        "to": contract_address,
-                        "data": method_signature
-                    },
-                    "latest"
-                ],
-                "id": 1
-            }
-            
-            headers = {
-                'Content-Type': 'application/json',
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            
-            response = requests.post(rpc_url, json=payload, headers=headers, timeout=30)
-            
-            if response.status_code == 200:
-                result = response.json()
-                if 'result' in result and result['result']:
-                    return result['result']
+            wait = float(retry_after)
+        except ValueError:
+            try:
+                wait = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                logger.warning(f"无法解析Retry-After响应头: {retry_after}，按指数退避")
+                return min(2 ** retry, self.max_retry_wait)
+        
+        wait = max(0.0, wait)
+        if wait > self.max_retry_wait:
+            logger.warning(f"服务器要求等待 {wait:.0f} 秒，超过上限 {self.max_retry_wait} 秒")
+            return None
+        return wait
+    
+    def post_rpc(self, network: str, payload) -> requests.Response:
+        """
+        向指定网络的RPC端点发送请求，遵守该端点的并发数与速率限制
+        
+        Args:
+            network: 网络名称
+            payload: JSON-RPC请求体
+            
+        Returns:
+            响应对象
+        """
+        network_lower = network.lower()
+        for retry in range(self.max_retries + 1):
+            with self.endpoint_semaphores[network_lower]:
+                self.rate_limiters[network_lower].acquire()
+                # session已设置Content-Type为application/json，直接发送序列化后的数据
+                response = self.sessions[network_lower].post(self.rpc_endpoints[network_lower], data=json_dumps(payload), timeout=30)
+            
+            if response.status_code != 429 or retry == self.max_retries:
+                return response
+            
+            # 被限流时退避重试，等待期间不占用该端点的并发名额，重试前重新获取令牌
+            wait = self.retry_wait(response.headers.get('Retry-After'), retry)
+            if wait is None:
+                return response
+            logger.warning(f"{network} 网络的RPC请求被限流 (429)，{wait} 秒后重试")
+            time.sleep(wait)
+    
+    def call_contract_method_batch(self, network: str, calls: List[Tuple[int, str]], method_signature: str) -> Dict[int, str]:
+        """
+        通过JSON-RPC批量请求一次调用多个合约的同一方法
+        
+        Args:
+            network: 网络名称
+            calls: (请求id, 合约地址) 的列表
+            method_signature: 方法签名
+            
+        Returns:
+            请求id到返回结果的映射，失败的调用不包含在内
+        """
+        try:
+            payload = [
+                {
+                    "jsonrpc": "2.0",
+                    "method": "eth_call",
+                    "params": [
+                        {
+                            "to": contract_address,
+                            "data": method_signature
+                        },
+                        "latest"
+                    ],
+                    "id": request_id
+                }
+                for request_id, contract_address in calls
+            ]
+            
+            response = self.post_rpc(network, payload)
+            
+            if response.status_code != 200:
+                logger.error(f"批量RPC请求失败，状态码: {response.status_code}")
+                return {}
+            
+            result = json_loads(response.content)
+            if not isinstance(result, list):
+                # 节点不支持批量请求时会返回单个错误对象
+                logger.warning(f"批量RPC调用返回异常结果: {result}")
+                return {}
+            
+            results = {}
+            for item in result:
+                if item.get('result'):
+                    results[item.get('id')] = item['result']
                 else:
-                    logger.warning(f"RPC调用返回空结果: {result}")
-                    return None
-            else:
-                logger.error(f"RPC请求失败，状态码: {response.status_code}")
-                return None
-                
+                    logger.warning(f"RPC调用返回空结果: {item}")
+            return results
+            
+        except requests.exceptions.RetryError as e:
+            logger.error(f"重试 {self.max_retries} 次后批量RPC请求仍失败: {e}")
+            return {}
         except Exception as e:
-            logger.error(f"调用合约方法时出错: {e}")
-            return None
+            logger.error(f"批量调用合约方法时出错: {e}")
+            return {}
     
-    def hex_to_decimal(self, hex_result: str) -> int:
+    def hex_to_decimal(self, hex_result: str) -> Optional[int]:
         """
         将十六进制结果转换为十进制
+        
+        Returns:
+            解析得到的精度，结果为空(如"0x")或无法解析时返回None，由调用方使用默认值
         """
         try:
             if hex_result.startswith('0x'):
                 hex_result = hex_result[2:]
-            
-            # 去除前导零
-            hex_result = hex_result.lstrip('0')
             if not hex_result:
-                hex_result = '0'
+                # 地址不是合约或没有decimals()方法
+                logger.warning("RPC调用返回空数据 0x")
+                return None
             
-            return int(hex_result, 16)
+            # decimals()返回uint8，只需解析最后一个字节
+            return int(hex_result[-2:], 16)
         except Exception as e:
             logger.error(f"十六进制转换错误: {e}")
-            return 18  # 默认返回18位精度
+            return None
     
     def get_token_decimals(self, network: str, contract_address: str) -> int:
         """
-        获取代币精度
+        获取单个代币的精度，复用批量查询的请求、解析与缓存逻辑
         """
+        key = self.cache_key(network, contract_address)
+        if key in self._dec_cache:
+            return self._dec_cache[key]
+        
         try:
-            # 获取RPC端点
-            rpc_url = self.get_rpc_endpoint(network)
-            if not rpc_url:
-                logger.error(f"不支持的网络: {network}")
-                return 18  # 默认精度
+            return self.get_tokens_decimals_batch(network, [(0, contract_address)])[0]
+        except Exception as e:
+            logger.error(f"获取代币精度时出错: {e}")
+            return 18  # 默认精度
+    
+    def get_tokens_decimals_batch(self, network: str, tokens: List[Tuple[int, str]]) -> Dict[int, int]:
+        """
+        通过一次批量请求获取同一网络上多个代币的精度
+        
+        Args:
+            network: 网络名称
+            tokens: (行索引, 合约地址) 的列表，长度不超过该网络的批量大小
             
+        Returns:
+            行索引到精度的映射，获取失败的代币使用默认值18
+        """
+        decimals_map = {index: 18 for index, _ in tokens}
+        
+        rpc_url = self.get_rpc_endpoint(network)
+        if not rpc_url:
+            logger.error(f"不支持的网络: {network}")
+            return decimals_map
+        
+        calls = []
+        for index, contract_address in tokens:
             # 确保合约地址格式正确
             if not contract_address.startswith('0x'):
                 contract_address = '0x' + contract_address
-            
-            logger.info(f"正在查询 {network} 网络上的合约 {contract_address} 的精度...")
-            
-            # 调用decimals()方法
-            result = self.call_contract_method(rpc_url, contract_address, self.decimals_signature)
-            
-            if result:
-                decimals = self.hex_to_decimal(result)
-                logger.info(f"成功获取精度: {decimals}")
-                return decimals
-            else:
-                logger.warning(f"无法获取精度，使用默认值18")
-                return 18
-                
-        except Exception as e:
-            logger.error(f"获取代币精度时出错: {e}")
-            return 18  # 默认精度
+            calls.append((index, contract_address))
+        
+        logger.info(f"正在批量查询 {network} 网络上的 {len(calls)} 个合约的精度...")
+        
+        results = self.call_contract_method_batch(network, calls, self.decimals_signature)
+        
+        # 只缓存成功解析的精度，默认值18不写入缓存
+        addresses = dict(calls)
+        parsed = 0
+        for index, hex_result in results.items():
+            if index in decimals_map:
+                decimals = self.hex_to_decimal(hex_result)
+                if decimals is None:
+                    continue
+                decimals_map[index] = decimals
+                self._dec_cache[self.cache_key(network, addresses[index])] = decimals
+                parsed += 1
+        
+        missing = len(calls) - parsed
+        if missing:
+            logger.warning(f"{network} 网络上有 {missing} 个合约无法获取精度，使用默认值18")
+        
+        return decimals_map
+    
+    def save_excel(self, df: pd.DataFrame, output_file: str) -> None:
+        """
+        使用openpyxl只写模式保存DataFrame，跳过单元格样式处理以加快写入
+        
+        Args:
+            df: 要保存的DataFrame
+            output_file: 输出文件路径
+        """
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet('Sheet1')
+        ws.append([str(column) for column in df.columns])
+        # 缺失值写为空单元格
+        for row in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+            ws.append(row)
+        wb.save(output_file)
     
     def process_excel(self):
         """处理Excel文件，获取所有代币的精度"""
@@ -141,49 +425,83 @@ class DecimalsFetcher:
             # 重置索引以确保按原始顺序处理
             df.reset_index(drop=True, inplace=True)
             
-            # 添加精度列
-            if 'decimals' not in df.columns:
-                df['decimals'] = None
+            # 先将结果收集到列表中，处理完成后一次性写入精度列
+            results = [None] * len(df)
             
-            # 处理每一行
-            for index, row in df.iterrows():
-                try:
-                    network = str(row.iloc[0]).strip()
-                    contract_address = str(row.iloc[1]).strip()
-                    
-                    if pd.isna(network) or pd.isna(contract_address) or network == 'nan' or contract_address == 'nan':
-                        logger.warning(f"第 {index+1} 行数据不完整，设置精度为18")
-                        df.at[index, 'decimals'] = 18
-                        continue
-                    
-                    logger.info(f"处理第 {index+1} 行: 网络={network}, 合约地址={contract_address}")
-                    
-                    # 获取精度
-                    decimals = self.get_token_decimals(network, contract_address)
-                    
-                    # 写入Excel
-                    df.at[index, 'decimals'] = decimals
-                    
-                    logger.info(f"第 {index+1} 行完成: decimals={decimals}")
-                    
-                    # 延迟1秒避免请求过快
-                    time.sleep(1)
+            # 一次性清洗网络和合约地址两列，数据不完整的行精度设为18
+            networks = df.iloc[:, 0].astype('string').str.strip()
+            addresses = df.iloc[:, 1].astype('string').str.strip()
+            invalid = (networks.isna() | addresses.isna() | (networks == '') | (addresses == '')).fillna(True).to_numpy(dtype=bool)
+            net_arr = networks.to_numpy(dtype=object)
+            addr_arr = addresses.to_numpy(dtype=object)
+            
+            # 按网络分组，以便批量发送RPC请求；已缓存或重复出现的代币不再查询
+            by_network: Dict[str, List[Tuple[int, str]]] = {}
+            duplicates: Dict[int, List[int]] = {}
+            first_index: Dict[Tuple[str, str], int] = {}
+            for index, (network, contract_address) in enumerate(zip(net_arr, addr_arr)):
+                if invalid[index]:
+                    logger.warning(f"第 {index+1} 行数据不完整，设置精度为18")
+                    results[index] = 18
+                    continue
+                
+                logger.info(f"处理第 {index+1} 行: 网络={network}, 合约地址={contract_address}")
+                
+                key = self.cache_key(network, contract_address)
+                if key in self._dec_cache:
+                    results[index] = self._dec_cache[key]
+                    logger.info(f"第 {index+1} 行使用缓存: decimals={results[index]}")
+                elif key in first_index:
+                    duplicates[first_index[key]].append(index)
+                else:
+                    first_index[key] = index
+                    duplicates[index] = []
+                    by_network.setdefault(network.lower(), []).append((index, contract_address))
+            
+            # 按批量大小切分任务
+            tasks = []
+            for network, tokens in by_network.items():
+                batch_size = self.batch_sizes.get(network, self.default_batch_size)
+                for start in range(0, len(tokens), batch_size):
+                    tasks.append((network, tokens[start:start + batch_size]))
+            
+            logger.info(f"开始使用 {self.max_workers} 个线程处理 {len(tasks)} 个批量请求")
+            
+            # 使用线程池并行发送批量请求
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                future_to_task = {executor.submit(self.get_tokens_decimals_batch, network, tokens): (network, tokens) for network, tokens in tasks}
+                
+                for future in as_completed(future_to_task):
+                    network, tokens = future_to_task[future]
+                    try:
+                        decimals_map = future.result()
+                    except Exception as e:
+                        logger.error(f"处理 {network} 网络的批量请求时出错: {e}")
+                        decimals_map = {index: 18 for index, _ in tokens}
                     
-                except Exception as e:
-                    logger.error(f"处理第 {index+1} 行时出错: {e}")
-                    df.at[index, 'decimals'] = 18  # 默认精度
+                    for index, decimals in decimals_map.items():
+                        results[index] = decimals
+                        logger.info(f"第 {index+1} 行完成: decimals={decimals}")
+                        for duplicate_index in duplicates[index]:
+                            results[duplicate_index] = decimals
+            
+            self.save_cache()
+            
+            # 写入精度列
+            df['decimals'] = pd.array(results, dtype='Int16')
             
             # 创建备份
-            backup_file = self.excel_file.replace('.xlsx', '_backup.xlsx')
-            df_original = pd.read_excel(self.excel_file)
-            df_original.to_excel(backup_file, index=False)
+            # 按扩展名拆分文件名，避免非.xlsx结尾的文件得到与原文件相同的路径
+            base_name, extension = os.path.splitext(self.excel_file)
+            backup_file = f"{base_name}_backup{extension}"
+            shutil.copyfile(self.excel_file, backup_file)
             logger.info(f"已创建备份文件: {backup_file}")
             
             # 保存结果，确保保持原始行顺序
-            output_file = self.excel_file.replace('.xlsx', '_with_decimals.xlsx')
+            output_file = f"{base_name}_with_decimals.xlsx"
             # 按照原始索引顺序排序，确保行顺序不变
             df_sorted = df.sort_index()
-            df_sorted.to_excel(output_file, index=False)
+            self.save_excel(df_sorted, output_file)
             logger.info(f"结果已保存到: {output_file}（保持原始行顺序）")
             
             # 显示统计信息
@@ -6,12 +6,21 @@
 """
 
 import pandas as pd
+from openpyxl import Workbook
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 import time
 import re
-from bs4 import BeautifulSoup
+import os
+import shutil
+from bs4 import BeautifulSoup, SoupStrainer
 import logging
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from typing import Tuple, Optional
+from urllib.parse import urlparse
 import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from queue import Queue
@@ -21,6 +30,34 @@ import json
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+class TokenBucket:
+    """令牌桶限速器，用于控制对单个主机的请求速率"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        Args:
+            rate: 每秒补充的令牌数
+            capacity: 令牌桶容量，默认等于rate
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """获取一个令牌，令牌不足时等待"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
 class TokenDataFetcher:
     def __init__(self, excel_file: str = "test.xlsx", max_workers: int = 5):
         """
@@ -34,7 +71,24 @@ class TokenDataFetcher:
         self.max_workers = max_workers
         self.base_url = "https://dex.coinmarketcap.com/token"
         self.session = requests.Session()
-        self.lock = threading.Lock()  # 线程锁用于文件写入
+        self._local = threading.local()  # 保存每个线程复用的session
+        # 每个主机每秒允许发送的请求数，未配置的主机使用默认值
+        self.default_rate_limit = 5
+        self.rate_limits = {
+            'dex.coinmarketcap.com': 5,
+        }
+        self.rate_limiters = {}
+        # 每个网络同时进行中的请求数上限，避免被限流的网络占满整个线程池
+        self.max_concurrent_per_network = 3
+        self.network_semaphores = {}
+        self._limiter_lock = threading.Lock()
+        # 按URL缓存已获取的页面结果，重复出现的代币无需再次请求和解析
+        self._page_cache = {}
+        self._cache_lock = threading.Lock()
+        # 遇到429、5xx或连接错误时的最大重试次数，重试间隔按指数增长
+        self.max_retries = 3
+        # 429限流后单次等待的最长秒数，服务器要求更久时放弃重试
+        self.max_retry_wait = 60
         # 设置请求头，模拟浏览器访问
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
@@ -45,9 +99,63 @@ class TokenDataFetcher:
             'Upgrade-Insecure-Requests': '1',
         })
         
+        # 预编译解析HTML时使用的正则表达式
+        self._value_pattern = r'</svg></span></div><dd class="static-box-value"><span class="sc-65e7f566-0 bxaIIt base-text"><span>([^<]+)</span></span>'
+        self._main_re = re.compile(self._value_pattern)
+        # 流式匹配时保留的上一块末尾长度，避免数值所在片段被分块截断
+        self._stream_overlap = 1024
+        self._label_res = {label: self._compile_label_patterns(label) for label in ("FDV", "liq", "24h VOL")}
+        self._script_res = [re.compile(pattern, re.IGNORECASE) for pattern in (
+            r'window\.__NEXT_DATA__\s*=\s*({.+?});',
+            r'window\.__INITIAL_STATE__\s*=\s*({.+?});',
+            r'"price":\s*"([^"]+)"',
+            r'"fdv":\s*"([^"]+)"',
+            r'"liquidity":\s*"([^"]+)"',
+            r'"volume24h":\s*"([^"]+)"'
+        )]
+        self._clean_re = re.compile(r'[$,\s%]')
+        # 普通数字、带K/M/B单位的数字或科学计数法
+        self._num_full = re.compile(r'\d+\.?\d*(?:[KMB]|e[+-]?\d+)?', re.IGNORECASE)
+        # 备用解析时只保留类名与数据项相关的元素，其余部分在解析阶段即被跳过
+        self._class_re = re.compile('fdv|market-cap|fully-diluted|liq|vol', re.IGNORECASE)
+        self._value_strainer = SoupStrainer(attrs={'class': self._class_re})
+        # data-key属性不在上面的过滤范围内，直接在HTML中匹配元素及其文本
+        self._data_key_re = re.compile(r'data-key\s*=\s*["\']([^"\']*)["\'][^>]*>([^<]+)<', re.IGNORECASE)
+        
+    def _compile_label_patterns(self, label: str) -> tuple:
+        """
+        编译指定标签对应的正则表达式
+        
+        Args:
+            label: 要查找的标签
+            
+        Returns:
+            (标签附近数值的正则, 备用正则列表) 的元组
+        """
+        # 在label附近查找对应的值
+        label_re = re.compile(rf'{label}.*?' + self._value_pattern, re.IGNORECASE | re.DOTALL)
+        # 备用模式匹配
+        backup_res = [re.compile(pattern, re.IGNORECASE) for pattern in (
+            rf'{label}[^>]*>([^<]+)<',
+            rf'"{label}"[^>]*>([^<]+)<',
+            rf'class="[^"]*{label.lower()}[^"]*"[^>]*>([^<]+)<'
+        )]
+        return label_re, backup_res
+        
     def create_session(self):
         """创建新的session对象用于线程安全"""
         session = requests.Session()
+        # 5xx和连接错误由urllib3自动退避重试
+        # 429不在此处重试：urllib3的重试会在占用并发名额时等待且绕过令牌桶，改由调用方在名额外退避
+        retry = Retry(
+            total=self.max_retries,
+            backoff_factor=0.3,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=['GET', 'POST']
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_maxsize=32)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
         session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
@@ -58,6 +166,83 @@ class TokenDataFetcher:
         })
         return session
         
+    def get_session(self) -> requests.Session:
+        """
+        获取当前线程的session对象，首次调用时创建
+        
+        同一线程处理的所有行共用一个session，复用已建立的TCP/TLS连接
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self.create_session()
+            self._local.session = session
+        return session
+        
+    def get_rate_limiter(self, url: str) -> TokenBucket:
+        """
+        获取URL所属主机的限速器
+        
+        Args:
+            url: 请求地址
+            
+        Returns:
+            该主机共享的TokenBucket对象
+        """
+        host = urlparse(url).netloc
+        with self._limiter_lock:
+            limiter = self.rate_limiters.get(host)
+            if limiter is None:
+                limiter = TokenBucket(self.rate_limits.get(host, self.default_rate_limit))
+                self.rate_limiters[host] = limiter
+        return limiter
+        
+    def get_network_semaphore(self, network: str) -> threading.Semaphore:
+        """
+        获取指定网络的并发控制信号量
+        
+        Args:
+            network: 网络名称
+            
+        Returns:
+            该网络共享的Semaphore对象
+        """
+        key = network.lower()
+        with self._limiter_lock:
+            semaphore = self.network_semaphores.get(key)
+            if semaphore is None:
+                semaphore = threading.Semaphore(self.max_concurrent_per_network)
+                self.network_semaphores[key] = semaphore
+        return semaphore
+        
+    def retry_wait(self, retry_after: Optional[str], retry: int) -> Optional[float]:
+        """
+        计算429限流后的等待秒数，优先使用Retry-After响应头，否则按指数退避
+        
+        Args:
+            retry_after: Retry-After响应头的值，可以是秒数或HTTP日期
+            retry: 已重试的次数
+            
+        Returns:
+            等待秒数；服务器要求等待超过max_retry_wait时返回None，表示放弃重试
+        """
+        if retry_after is None:
+            return min(2 ** retry, self.max_retry_wait)
+        
+        try:
+            wait = float(retry_after)
+        except ValueError:
+            try:
+                wait = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                logger.warning(f"无法解析Retry-After响应头: {retry_after}，按指数退避")
+                return min(2 ** retry, self.max_retry_wait)
+        
+        wait = max(0.0, wait)
+        if wait > self.max_retry_wait:
+            logger.warning(f"服务器要求等待 {wait:.0f} 秒，超过上限 {self.max_retry_wait} 秒")
+            return None
+        return wait
+    
     def load_excel_data(self) -> pd.DataFrame:
         """
         加载Excel文件数据
@@ -77,6 +262,47 @@ class TokenDataFetcher:
             logger.error(f"加载Excel文件时出错: {e}")
             raise
     
+    def prepare_columns(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        补足5列并设置结果列的列名
+        
+        Args:
+            df: 原始DataFrame
+            
+        Returns:
+            包含FDV、Liquidity和24h Volume列的DataFrame
+        """
+        # 一次性补齐缺少的列，避免逐列添加时反复复制数据
+        missing = max(0, 5 - df.shape[1])
+        if missing:
+            padding = pd.DataFrame(
+                {f'Column_{df.shape[1] + i}': pd.Series(None, index=df.index, dtype=object) for i in range(missing)},
+                index=df.index
+            )
+            df = pd.concat([df, padding], axis=1)
+        
+        df.columns = list(df.columns[:2]) + ['FDV', 'Liquidity', '24h Volume']
+        return df
+    
+    def clean_input_columns(self, df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        一次性清洗网络和合约地址两列，并标记数据不完整的行
+        
+        Args:
+            df: 前两列分别为网络和合约地址的DataFrame
+            
+        Returns:
+            (网络数组, 合约地址数组, 数据不完整行的布尔掩码) 的元组，均按行位置索引
+        """
+        networks = df.iloc[:, 0].astype('string').str.strip()
+        addresses = df.iloc[:, 1].astype('string').str.strip()
+        invalid = networks.isna() | addresses.isna() | (networks == '') | (addresses == '')
+        return networks.to_numpy(dtype=object), addresses.to_numpy(dtype=object), invalid.fillna(True).to_numpy(dtype=bool)
+    
+    def token_url(self, network: str, contract_address: str) -> str:
+        """生成代币在CoinMarketCap上的页面地址"""
+        return f"{self.base_url}/{network}/{contract_address}/"
+    
     def fetch_token_data(self, network: str, contract_address: str, session: requests.Session = None) -> Tuple[str, str, str]:
         """
         获取代币数据
@@ -89,29 +315,91 @@ class TokenDataFetcher:
         Returns:
             (FDV, Liquidity, 24h Volume) 的元组
         """
-        url = f"{self.base_url}/{network}/{contract_address}/"
+        url = self.token_url(network, contract_address)
+        
+        with self._cache_lock:
+            cached = self._page_cache.get(url)
+        if cached is not None:
+            logger.info(f"使用缓存结果: {url}")
+            return cached
         
-        # 使用传入的session或创建新的
+        # 使用传入的session或当前线程的session
         if session is None:
-            session = self.create_session()
+            session = self.get_session()
         
         try:
-            logger.info(f"正在请求: {url}")
-            response = session.get(url, timeout=30)
-            
-            if response.status_code == 200:
-                return self.parse_html_data(response.text)
-            elif response.status_code == 404:
-                logger.warning(f"页面不存在 (404): {url}")
-                return "0", "0", "0"
-            else:
-                logger.warning(f"请求失败，状态码: {response.status_code}")
-                return "0", "0", "0"
+            for retry in range(self.max_retries + 1):
+                logger.info(f"正在请求: {url}")
+                # 先按网络限制并发数，取得名额后再按主机限速，避免排队的线程提前消耗令牌后集中发出请求
+                # 5xx由session挂载的Retry自动退避重试
+                with self.get_network_semaphore(network):
+                    self.get_rate_limiter(url).acquire()
+                    with session.get(url, timeout=30, stream=True) as response:
+                        if response.status_code == 200:
+                            result = self.stream_parse_html(response)
+                            with self._cache_lock:
+                                self._page_cache[url] = result
+                            return result
+                        elif response.status_code == 404:
+                            logger.warning(f"页面不存在 (404): {url}")
+                            with self._cache_lock:
+                                self._page_cache[url] = ("0", "0", "0")
+                            return "0", "0", "0"
+                        elif response.status_code != 429:
+                            logger.warning(f"请求失败，状态码: {response.status_code}")
+                            return "0", "0", "0"
+                        retry_after = response.headers.get('Retry-After')
+                
+                # 被限流时退避重试，等待期间不占用该网络的并发名额，重试前重新获取令牌
+                if retry < self.max_retries:
+                    wait = self.retry_wait(retry_after, retry)
+                    if wait is None:
+                        logger.warning(f"请求被限流 (429)，放弃: {url}")
+                        return "0", "0", "0"
+                    logger.warning(f"请求被限流 (429)，{wait} 秒后重试: {url}")
+                    time.sleep(wait)
+            
+            logger.warning(f"请求多次被限流，放弃: {url}")
+            return "0", "0", "0"
                 
+        except requests.exceptions.RetryError as e:
+            logger.error(f"重试 {self.max_retries} 次后请求仍失败: {url}, {e}")
+            return "0", "0", "0"
         except requests.RequestException as e:
             logger.error(f"请求异常: {e}")
             return "0", "0", "0"
     
+    def stream_parse_html(self, response: requests.Response) -> Tuple[str, str, str]:
+        """
+        边下载边匹配数值，找到3个数据后立即停止读取页面
+        
+        Args:
+            response: 以stream=True发起请求得到的响应对象
+            
+        Returns:
+            (FDV, Liquidity, 24h Volume) 的元组
+        """
+        if response.encoding is None:
+            response.encoding = 'utf-8'
+        
+        buffer = ''
+        search_from = 0
+        matches = []
+        for chunk in response.iter_content(chunk_size=65536, decode_unicode=True):
+            buffer += chunk
+            for match in self._main_re.finditer(buffer, search_from):
+                matches.append(match.group(1).strip())
+                search_from = match.end()
+                if len(matches) == 3:
+                    fdv, liquidity, volume_24h = matches
+                    logger.info(f"流式读取时找到3个数据: FDV={fdv}, Liquidity={liquidity}, Volume={volume_24h}")
+                    return fdv, liquidity, volume_24h
+            # 下一块到达后从可能被截断的位置继续匹配
+            search_from = max(search_from, len(buffer) - self._stream_overlap)
+        
+        # 读取完整页面仍未找到3个数据，使用完整的解析流程
+        return self.parse_html_data(buffer)
+    
     def parse_html_data(self, html_content: str) -> Tuple[str, str, str]:
         """
         解析HTML内容，提取FDV、Liquidity和24h Volume数据
@@ -123,29 +411,31 @@ class TokenDataFetcher:
             (FDV, Liquidity, 24h Volume) 的元组
         """
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            
             # 方法1: 优先使用新的正则表达式模式检查是否获取到3个数据
             fdv, liquidity, volume_24h = self.extract_all_values_by_pattern(html_content)
             
-            # 如果新模式没有获取到有效数据，尝试其他方法
-            if fdv == "0" and liquidity == "0" and volume_24h == "0":
-                # 方法2: 尝试查找指定的HTML模式
-                fdv = self.extract_value_by_pattern(html_content, "FDV")
-                liquidity = self.extract_value_by_pattern(html_content, "liq")
-                volume_24h = self.extract_value_by_pattern(html_content, "24h VOL")
-                
-                # 方法3: 如果方法2失败，尝试查找常见的数据显示模式
+            # 新模式获取到有效数据时直接返回，无需构建BeautifulSoup对象
+            if (fdv, liquidity, volume_24h) != ("0", "0", "0"):
+                return fdv, liquidity, volume_24h
+            
+            # 方法2: 尝试查找指定的HTML模式
+            fdv = self.extract_value_by_pattern(html_content, "FDV")
+            liquidity = self.extract_value_by_pattern(html_content, "liq")
+            volume_24h = self.extract_value_by_pattern(html_content, "24h VOL")
+            
+            # 方法3: 如果方法2失败，尝试查找常见的数据显示模式
+            if not (fdv and liquidity and volume_24h):
+                soup = BeautifulSoup(html_content, 'lxml', parse_only=self._value_strainer)
                 if not fdv:
-                    fdv = self.extract_value_by_class(soup, ["fdv", "market-cap", "fully-diluted"])
+                    fdv = self.extract_value_by_class(soup, html_content, ["fdv", "market-cap", "fully-diluted"])
                 if not liquidity:
-                    liquidity = self.extract_value_by_class(soup, ["liquidity", "liq"])
+                    liquidity = self.extract_value_by_class(soup, html_content, ["liquidity", "liq"])
                 if not volume_24h:
-                    volume_24h = self.extract_value_by_class(soup, ["volume", "24h-volume", "vol"])
-                
-                # 方法4: 尝试从JSON数据中提取
-                if not any([fdv, liquidity, volume_24h]):
-                    fdv, liquidity, volume_24h = self.extract_from_script_data(html_content)
+                    volume_24h = self.extract_value_by_class(soup, html_content, ["volume", "24h-volume", "vol"])
+            
+            # 方法4: 尝试从JSON数据中提取
+            if not any([fdv, liquidity, volume_24h]):
+                fdv, liquidity, volume_24h = self.extract_from_script_data(html_content)
             
             return fdv or "0", liquidity or "0", volume_24h or "0"
             
@@ -165,12 +455,13 @@ class TokenDataFetcher:
             提取的值或None
         """
         try:
-            # 根据文档中提到的HTML模式进行匹配
-            pattern = rf'</svg></span></div><dd class="static-box-value"><span class="sc-65e7f566-0 bxaIIt base-text"><span>([^<]+)</span></span>'
+            label_res = self._label_res.get(label)
+            if label_res is None:
+                label_res = self._compile_label_patterns(label)
+            label_re, backup_res = label_res
             
-            # 在label附近查找对应的值
-            label_pattern = rf'{label}.*?' + pattern
-            match = re.search(label_pattern, html_content, re.IGNORECASE | re.DOTALL)
+            # 根据文档中提到的HTML模式，在label附近查找对应的值
+            match = label_re.search(html_content)
             
             if match:
                 value = match.group(1).strip()
@@ -178,14 +469,8 @@ class TokenDataFetcher:
                 return value
                 
             # 备用模式匹配
-            backup_patterns = [
-                rf'{label}[^>]*>([^<]+)<',
-                rf'"{label}"[^>]*>([^<]+)<',
-                rf'class="[^"]*{label.lower()}[^"]*"[^>]*>([^<]+)<'
-            ]
-            
-            for pattern in backup_patterns:
-                match = re.search(pattern, html_content, re.IGNORECASE)
+            for backup_re in backup_res:
+                match = backup_re.search(html_content)
                 if match:
                     value = match.group(1).strip()
                     logger.info(f"找到 {label} (备用模式): {value}")
@@ -207,11 +492,8 @@ class TokenDataFetcher:
             (FDV, Liquidity, 24h Volume) 的元组
         """
         try:
-            # 使用您提供的正则表达式模式
-            pattern = r'</svg></span></div><dd class="static-box-value"><span class="sc-65e7f566-0 bxaIIt base-text"><span>([^<]+)</span></span>'
-            
-            # 查找所有匹配的数据
-            matches = re.findall(pattern, html_content)
+            # 使用预编译的正则表达式查找所有匹配的数据
+            matches = self._main_re.findall(html_content)
             
             logger.info(f"使用正则表达式找到 {len(matches)} 个数据: {matches}")
             
@@ -232,12 +514,13 @@ class TokenDataFetcher:
             logger.error(f"使用正则表达式提取数据时出错: {e}")
             return "0", "0", "0"
     
-    def extract_value_by_class(self, soup: BeautifulSoup, class_keywords: list) -> Optional[str]:
+    def extract_value_by_class(self, soup: BeautifulSoup, html_content: str, class_keywords: list) -> Optional[str]:
         """
-        根据CSS类名关键字提取数值
+        根据CSS类名或data-key属性中的关键字提取数值
         
         Args:
-            soup: BeautifulSoup对象
+            soup: 使用self._value_strainer解析得到的BeautifulSoup对象
+            html_content: HTML内容，用于查找data-key属性
             class_keywords: 类名关键字列表
             
         Returns:
@@ -253,10 +536,10 @@ class TokenDataFetcher:
                         return text
                         
                 # 查找data属性包含关键字的元素
-                elements = soup.find_all(attrs={"data-key": re.compile(keyword, re.IGNORECASE)})
-                for element in elements:
-                    text = element.get_text(strip=True)
-                    if text and self.is_numeric_value(text):
+                keyword_re = re.compile(keyword, re.IGNORECASE)
+                for match in self._data_key_re.finditer(html_content):
+                    text = match.group(2).strip()
+                    if keyword_re.search(match.group(1)) and text and self.is_numeric_value(text):
                         return text
                         
         except Exception as e:
@@ -275,20 +558,11 @@ class TokenDataFetcher:
             (FDV, Liquidity, 24h Volume) 的元组
         """
         try:
-            # 查找JSON数据
-            script_patterns = [
-                r'window\.__NEXT_DATA__\s*=\s*({.+?});',
-                r'window\.__INITIAL_STATE__\s*=\s*({.+?});',
-                r'"price":\s*"([^"]+)"',
-                r'"fdv":\s*"([^"]+)"',
-                r'"liquidity":\s*"([^"]+)"',
-                r'"volume24h":\s*"([^"]+)"'
-            ]
-            
             fdv = liquidity = volume_24h = None
             
-            for pattern in script_patterns:
-                matches = re.findall(pattern, html_content, re.IGNORECASE)
+            # 查找JSON数据
+            for script_re in self._script_res:
+                matches = script_re.findall(html_content)
                 if matches:
                     # 这里可以进一步解析JSON数据
                     logger.info(f"找到脚本数据匹配: {len(matches)} 个")
@@ -311,23 +585,17 @@ class TokenDataFetcher:
             是否为数值型
         """
         # 移除常见的格式字符
-        cleaned = re.sub(r'[$,\s%]', '', text)
+        cleaned = self._clean_re.sub('', text)
         
         # 检查是否为数字、科学计数法或包含K、M、B等单位
-        patterns = [
-            r'^\d+\.?\d*$',  # 普通数字
-            r'^\d+\.?\d*[KMB]$',  # 带单位的数字
-            r'^\d+\.?\d*e[+-]?\d+$',  # 科学计数法
-        ]
-        
-        return any(re.match(pattern, cleaned, re.IGNORECASE) for pattern in patterns)
+        return bool(self._num_full.fullmatch(cleaned))
     
     def process_single_row(self, args: tuple) -> tuple:
         """
         处理单个行的数据
         
         Args:
-            args: (index, network, contract_address) 的元组
+            args: (index, network, contract_address) 的元组，网络和合约地址已清洗
             
         Returns:
             (index, fdv, liquidity, volume_24h) 的元组
@@ -335,15 +603,8 @@ class TokenDataFetcher:
         index, network, contract_address = args
         
         try:
-            # 为每个线程创建独立的session
-            session = self.create_session()
-            
-            if pd.isna(network) or pd.isna(contract_address) or not str(network).strip() or not str(contract_address).strip():
-                logger.warning(f"第 {index+1} 行数据不完整，跳过")
-                return index, "0", "0", "0"
-            
-            network = str(network).strip()
-            contract_address = str(contract_address).strip()
+            # 每个线程使用独立的session，并在多行之间复用
+            session = self.get_session()
             
             logger.info(f"处理第 {index+1} 行: {network} - {contract_address}")
             
@@ -352,15 +613,55 @@ class TokenDataFetcher:
             
             logger.info(f"第 {index+1} 行数据获取完成: FDV={fdv}, Liquidity={liquidity}, Volume={volume_24h}")
             
-            # 添加小延迟避免请求过快
-            time.sleep(1)
-            
             return index, fdv, liquidity, volume_24h
             
         except Exception as e:
             logger.error(f"处理第 {index+1} 行时出错: {e}")
             return index, "0", "0", "0"
     
+    def save_excel(self, df: pd.DataFrame, output_file: str) -> None:
+        """
+        使用openpyxl只写模式保存DataFrame，跳过单元格样式处理以加快写入
+        
+        Args:
+            df: 要保存的DataFrame
+            output_file: 输出文件路径
+        """
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet('Sheet1')
+        ws.append([str(column) for column in df.columns])
+        # 缺失值写为空单元格
+        for row in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+            ws.append(row)
+        wb.save(output_file)
+    
+    def result_file_path(self) -> str:
+        """
+        生成结果文件路径
+        
+        按扩展名拆分文件名，避免非.xlsx结尾(如.XLSX)的文件得到与原文件相同的路径而被直接覆盖
+        """
+        base_name, _ = os.path.splitext(self.excel_file)
+        return f"{base_name}_result.xlsx"
+    
+    def update_source_file(self, output_file: str) -> None:
+        """
+        用已保存的结果文件原子地替换原Excel文件
+        
+        先复制到同目录下的临时文件，再通过os.replace替换，避免重复序列化，
+        写入中途出错时原文件也不会损坏
+        
+        Args:
+            output_file: 已保存的结果文件路径
+        """
+        tmp_file = self.excel_file + '.tmp'
+        try:
+            shutil.copyfile(output_file, tmp_file)
+            os.replace(tmp_file, self.excel_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+    
     def process_excel_file(self) -> None:
         """
         处理Excel文件，使用多线程获取所有代币数据并写回文件
@@ -369,22 +670,37 @@ class TokenDataFetcher:
             # 加载数据
             df = self.load_excel_data()
             
-            # 确保有足够的列
-            while len(df.columns) < 5:
-                df[f'Column_{len(df.columns)}'] = None
+            # 确保有足够的列并设置列名
+            df = self.prepare_columns(df)
             
-            # 设置列名
-            df.columns = list(df.columns[:2]) + ['FDV', 'Liquidity', '24h Volume']
+            # 清洗输入数据，不完整的行直接跳过
+            net_arr, addr_arr, invalid = self.clean_input_columns(df)
+            for index in np.flatnonzero(invalid):
+                logger.warning(f"第 {index+1} 行数据不完整，跳过")
             
-            # 准备线程池参数
+            # 准备线程池参数，同一页面只提交一次，其余重复行在完成后复制结果
             tasks = []
-            for index, row in df.iterrows():
-                network = row.iloc[0]
-                contract_address = row.iloc[1]
-                tasks.append((index, network, contract_address))
+            duplicates = {}
+            first_index = {}
+            for index, (network, contract_address) in enumerate(zip(net_arr, addr_arr)):
+                if invalid[index]:
+                    continue
+                url = self.token_url(network, contract_address)
+                if url in first_index:
+                    duplicates[first_index[url]].append(index)
+                else:
+                    first_index[url] = index
+                    duplicates[index] = []
+                    tasks.append((index, network, contract_address))
             
             logger.info(f"开始使用 {self.max_workers} 个线程处理 {len(tasks)} 个任务")
             
+            # 预分配结果数组，处理完成后一次性写入DataFrame
+            n = len(df)
+            fdv_arr = np.full(n, "0", dtype=object)
+            liq_arr = np.full(n, "0", dtype=object)
+            vol_arr = np.full(n, "0", dtype=object)
+            
             # 使用线程池并行处理
             with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
                 # 提交所有任务
@@ -396,28 +712,29 @@ class TokenDataFetcher:
                     try:
                         result_index, fdv, liquidity, volume_24h = future.result()
                         
-                        # 线程安全地写入数据
-                        with self.lock:
-                            df.loc[result_index, 'FDV'] = fdv
-                            df.loc[result_index, 'Liquidity'] = liquidity
-                            df.loc[result_index, '24h Volume'] = volume_24h
+                        # 每个任务对应不同的行，直接写入数组无需加锁
+                        for row_index in [result_index] + duplicates[result_index]:
+                            fdv_arr[row_index] = fdv
+                            liq_arr[row_index] = liquidity
+                            vol_arr[row_index] = volume_24h
                         
                         logger.info(f"完成任务 {result_index+1}/{len(tasks)}")
                         
                     except Exception as e:
                         logger.error(f"获取第 {index+1} 行结果时出错: {e}")
-                        with self.lock:
-                            df.loc[index, 'FDV'] = "0"
-                            df.loc[index, 'Liquidity'] = "0"
-                            df.loc[index, '24h Volume'] = "0"
+            
+            # 一次性写入结果列
+            df['FDV'] = fdv_arr
+            df['Liquidity'] = liq_arr
+            df['24h Volume'] = vol_arr
             
             # 保存结果
-            output_file = self.excel_file.replace('.xlsx', '_result.xlsx')
-            df.to_excel(output_file, index=False)
+            output_file = self.result_file_path()
+            self.save_excel(df, output_file)
             logger.info(f"结果已保存到: {output_file}")
             
-            # 同时保存到原文件
-            df.to_excel(self.excel_file, index=False)
+            # 同时更新原文件
+            self.update_source_file(output_file)
             logger.info(f"结果已更新到原文件: {self.excel_file}")
             
         except Exception as e:
@@ -432,54 +749,53 @@ class TokenDataFetcher:
             # 加载数据
             df = self.load_excel_data()
             
-            # 确保有足够的列
-            while len(df.columns) < 5:
-                df[f'Column_{len(df.columns)}'] = None
+            # 确保有足够的列并设置列名
+            df = self.prepare_columns(df)
+            
+            # 预分配结果数组，处理完成后一次性写入DataFrame
+            n = len(df)
+            fdv_arr = np.full(n, "0", dtype=object)
+            liq_arr = np.full(n, "0", dtype=object)
+            vol_arr = np.full(n, "0", dtype=object)
             
-            # 设置列名
-            df.columns = list(df.columns[:2]) + ['FDV', 'Liquidity', '24h Volume']
+            # 清洗输入数据，不完整的行直接跳过
+            net_arr, addr_arr, invalid = self.clean_input_columns(df)
             
             # 处理每一行数据
-            for index, row in df.iterrows():
+            for index, (network, contract_address) in enumerate(zip(net_arr, addr_arr)):
+                if invalid[index]:
+                    logger.warning(f"第 {index+1} 行数据不完整，跳过")
+                    continue
+                
                 try:
-                    network = str(row.iloc[0]).strip()
-                    contract_address = str(row.iloc[1]).strip()
-                    
-                    if pd.isna(network) or pd.isna(contract_address) or not network or not contract_address:
-                        logger.warning(f"第 {index+1} 行数据不完整，跳过")
-                        df.loc[index, 'FDV'] = "0"
-                        df.loc[index, 'Liquidity'] = "0" 
-                        df.loc[index, '24h Volume'] = "0"
-                        continue
-                    
                     logger.info(f"处理第 {index+1} 行: {network} - {contract_address}")
                     
                     # 获取数据
                     fdv, liquidity, volume_24h = self.fetch_token_data(network, contract_address)
                     
                     # 写入数据
-                    df.loc[index, 'FDV'] = fdv
-                    df.loc[index, 'Liquidity'] = liquidity
-                    df.loc[index, '24h Volume'] = volume_24h
+                    fdv_arr[index] = fdv
+                    liq_arr[index] = liquidity
+                    vol_arr[index] = volume_24h
                     
                     logger.info(f"第 {index+1} 行数据获取完成: FDV={fdv}, Liquidity={liquidity}, Volume={volume_24h}")
                     
-                    # 添加延迟避免请求过快
-                    time.sleep(2)
-                    
                 except Exception as e:
                     logger.error(f"处理第 {index+1} 行时出错: {e}")
-                    df.loc[index, 'FDV'] = "0"
-                    df.loc[index, 'Liquidity'] = "0"
-                    df.loc[index, '24h Volume'] = "0"
+                    fdv_arr[index] = liq_arr[index] = vol_arr[index] = "0"
+            
+            # 一次性写入结果列
+            df['FDV'] = fdv_arr
+            df['Liquidity'] = liq_arr
+            df['24h Volume'] = vol_arr
             
             # 保存结果
-            output_file = self.excel_file.replace('.xlsx', '_result.xlsx')
-            df.to_excel(output_file, index=False)
+            output_file = self.result_file_path()
+            self.save_excel(df, output_file)
             logger.info(f"结果已保存到: {output_file}")
             
-            # 同时保存到原文件
-            df.to_excel(self.excel_file, index=False)
+            # 同时更新原文件
+            self.update_source_file(output_file)
             logger.info(f"结果已更新到原文件: {self.excel_file}")
             
         except Exception as e: